@@ -1,61 +1,154 @@
 import json
+import mmap
+import threading
+from collections import defaultdict
+from functools import lru_cache
 from pathlib import Path
 from datetime import datetime
+from typing import NamedTuple
+
+import numpy as np
+
+try:
+    import orjson
+    _json_loads = orjson.loads
+except ImportError:  # stdlib fallback if orjson isn't installed
+    def _json_loads(buf):
+        return json.loads(bytes(buf))
 
 
 # Load the file once at startup
 LOADS_FILE = Path(__file__).resolve().parents[1] / "data" / "loads.json"
 
+class _Catalog(NamedTuple):
+    """One consistent snapshot of the loads and every index built from them."""
+    loads: list
+    by_id: dict             # load_id -> load
+    by_equip: dict          # lowercased equipment_type -> row indices into loads
+    # Columnar copies of the numeric filter fields, aligned with loads
+    weight: np.ndarray
+    pickup: np.ndarray
+    # Lowercased origin/destination, aligned with loads, so filters never call .lower() per row
+    origin_lc: list
+    dest_lc: list
+    # Trigram -> row indices for the "contains" filters on origin/destination
+    origin_trigrams: dict
+    dest_trigrams: dict
+
+# In-memory catalog; populated at import and swapped atomically by reload_loads(): readers
+# take _CATALOG once per call, so a concurrent reload never mixes old and new arrays
+_CATALOG = _Catalog([], {}, {}, np.empty(0, dtype=np.int64), np.empty(0, dtype="datetime64[us]"),
+                    [], [], {}, {})
+_NO_ROWS = np.empty(0, dtype=np.intp)
+_LOADS_LOCK = threading.Lock()
+
+def _trigrams(text):
+    return {text[i:i + 3] for i in range(len(text) - 2)}
+
+def _build_trigram_index(values):
+    index = defaultdict(set)
+    for i, value in enumerate(values):
+        for gram in _trigrams(value):
+            index[gram].add(i)
+    return dict(index)
+
+def reload_loads():
+    """Re-read loads.json into the in-memory cache (startup, tests, data refresh)."""
+    global _CATALOG
+    with _LOADS_LOCK:
+        # Parse straight from a read-only mapping: the kernel pages the file in,
+        # no intermediate bytes copy on the Python heap
+        with open(LOADS_FILE, "rb") as f, mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as mm:
+            with memoryview(mm) as view:
+                loads = _json_loads(view)
+        by_id, by_equip = {}, defaultdict(list)
+        for i, load in enumerate(loads):
+            by_id.setdefault(load["load_id"], load)   # first match wins, as before
+            by_equip[load["equipment_type"].lower()].append(i)
+        origin_lc = [load["origin"].lower() for load in loads]
+        dest_lc = [load["destination"].lower() for load in loads]
+        # Built completely before the single assignment below publishes it
+        _CATALOG = _Catalog(
+            loads=loads,
+            by_id=by_id,
+            by_equip={k: np.array(v, dtype=np.intp) for k, v in by_equip.items()},
+            weight=np.array([int(load["weight"]) for load in loads], dtype=np.int64),
+            # Parsed once here; the records handed to callers stay untouched
+            pickup=np.array([load["pickup_datetime"] for load in loads], dtype="datetime64[us]"),
+            origin_lc=origin_lc,
+            dest_lc=dest_lc,
+            origin_trigrams=_build_trigram_index(origin_lc),
+            dest_trigrams=_build_trigram_index(dest_lc),
+        )
+        _top_loads_cached.cache_clear()
+        return loads
+
+def get_loads():
+    return _CATALOG.loads
+
 def load_all_loads():
-    with open(LOADS_FILE, "r") as f:
-        return json.load(f)
+    # Kept for existing callers; no disk I/O per request anymore
+    return get_loads()
 
 def get_load_by_id(load_id: str):
-    loads = load_all_loads()
-    for load in loads:
-        if load["load_id"] == load_id:
-            return load
-    return None
+    return _CATALOG.by_id.get(load_id)
 
 
+# Carriers repeat the same few date strings, so a parsed cutoff is reused across requests
+@lru_cache(maxsize=256)
+def _parse_cutoff(value):
+    try:
+        dt = datetime.fromisoformat(value)
+    except ValueError:
+        dt = datetime.strptime(value, "%Y-%m-%d")
+    return np.datetime64(dt)
+
+def _trigram_candidates(index, needle_lc):
+    """Rows containing every trigram of the needle: a superset of the real substring matches."""
+    rows = set.intersection(*(index.get(gram, set()) for gram in _trigrams(needle_lc)))
+    return np.fromiter(rows, dtype=np.intp, count=len(rows))
+
+# Exact substring verification specialised per (origin?, destination?) combination,
+# so the per-row loop carries no "is this filter active" checks
+_VERIFY_ROWS = {
+    (False, False): lambda c, rows, o, d: [c.loads[i] for i in rows],
+    (True, False): lambda c, rows, o, d: [c.loads[i] for i in rows if o in c.origin_lc[i]],
+    (False, True): lambda c, rows, o, d: [c.loads[i] for i in rows if d in c.dest_lc[i]],
+    (True, True): lambda c, rows, o, d: [c.loads[i] for i in rows
+                                         if o in c.origin_lc[i] and d in c.dest_lc[i]],
+}
+
 def filter_loads(origin=None, destination=None, equipment_type=None,
                 pickup_date_before=None, pickup_date_after=None, max_weight=None):
-    loads = load_all_loads()
-    filtered = []
-
-    for load in loads:
-        
-            
-        if origin and origin.lower() not in load["origin"].lower():
-            continue
-        if destination and destination.lower() not in load["destination"].lower():
-            continue
-        if equipment_type and equipment_type.lower() != load["equipment_type"].lower():
-            continue
-        pickup_dt = datetime.fromisoformat(load["pickup_datetime"])
-         # Before filter
-        if pickup_date_before:
-            try:
-                cutoff_before = datetime.fromisoformat(pickup_date_before)
-            except ValueError:
-                cutoff_before = datetime.strptime(pickup_date_before, "%Y-%m-%d")
-            if pickup_dt > cutoff_before:
-                continue
-
-        # After filter
-        if pickup_date_after:
-            try:
-                cutoff_after = datetime.fromisoformat(pickup_date_after)
-            except ValueError:
-                cutoff_after = datetime.strptime(pickup_date_after, "%Y-%m-%d")
-            if pickup_dt < cutoff_after:
-                continue
-        if max_weight and int(load["weight"]) > int(max_weight):
-            continue
-        
-        filtered.append(load)
-
-    return filtered
+    cat = _CATALOG  # one snapshot for the whole query
+    # Cheapest/most selective first: equipment index, weight, then dates
+    if equipment_type:
+        mask = np.zeros(len(cat.loads), dtype=bool)
+        mask[cat.by_equip.get(equipment_type.lower(), _NO_ROWS)] = True
+    else:
+        mask = np.ones(len(cat.loads), dtype=bool)
+    if max_weight:
+        mask &= cat.weight <= int(max_weight)
+    # Date columns are only touched when a date filter is present; no per-row datetime work
+    # Before filter
+    if pickup_date_before:
+        mask &= cat.pickup <= _parse_cutoff(pickup_date_before)
+    # After filter
+    if pickup_date_after:
+        mask &= cat.pickup >= _parse_cutoff(pickup_date_after)
+
+    origin_lc = origin.lower() if origin else None
+    dest_lc = destination.lower() if destination else None
+    # Narrow origin/destination via the trigram index; needles < 3 chars fall back to the scan
+    for index, needle in ((cat.origin_trigrams, origin_lc), (cat.dest_trigrams, dest_lc)):
+        if needle and len(needle) >= 3:
+            candidates = np.zeros(len(cat.loads), dtype=bool)
+            candidates[_trigram_candidates(index, needle)] = True
+            mask &= candidates
+
+    # Exact substring verification only runs over the rows that survived the masks
+    verify = _VERIFY_ROWS[bool(origin_lc), bool(dest_lc)]
+    return verify(cat, np.flatnonzero(mask).tolist(), origin_lc, dest_lc)
 
 def get_top_loads_from_preferences(preferences: dict, limit: int = 3):
     origin = preferences.get("origin")
@@ -65,6 +158,21 @@ def get_top_loads_from_preferences(preferences: dict, limit: int = 3):
     pickup_date_before = preferences.get("pickup_date_before")
     max_weight = preferences.get("max_weight")
 
+    try:
+        top = _top_loads_cached(origin, destination, equipment_type,
+                                pickup_date_after, pickup_date_before, max_weight, limit)
+    except TypeError:
+        # Unhashable values (lists/dicts) can't be cache keys; filter uncached
+        top = _top_loads_cached.__wrapped__(origin, destination, equipment_type,
+                                            pickup_date_after, pickup_date_before, max_weight, limit)
+    # Fresh list per caller so nobody can mutate the cached entry
+    return list(top)
+
+# Keyed only on the six filter fields, so extra keys in the payload don't fragment the cache.
+# The catalog is immutable between reloads; reload_loads() clears it.
+@lru_cache(maxsize=1024)
+def _top_loads_cached(origin, destination, equipment_type,
+                      pickup_date_after, pickup_date_before, max_weight, limit):
     filtered = filter_loads(
         origin=origin,
         destination=destination,
@@ -74,4 +182,7 @@ def get_top_loads_from_preferences(preferences: dict, limit: int = 3):
         max_weight=max_weight
     )
 
-    return filtered[:limit]
+    return tuple(filtered[:limit])
+
+
+reload_loads()
@@ -1,27 +1,53 @@
 # backend/main.py
 from fastapi import FastAPI, Query, HTTPException, Body, Request, Depends, APIRouter
 from fastapi.middleware.cors import CORSMiddleware
+from fastapi.responses import ORJSONResponse
 from backend.load_data import filter_loads, get_load_by_id, get_top_loads_from_preferences
 from typing import Optional, Any
 from pydantic import BaseModel
 from datetime import datetime
 from backend.routes.fmcsa_verification import router as fmcsa_router
-from backend.negotiation import update_negotiation_session, reset_session
+from backend.utils.fmcsa import close_fmcsa_client
+from backend.negotiation import (
+    aupdate_negotiation_session, areset_session, close_redis, areserve_replay, aremember_replay
+)
 from backend.security import validate_api_key
-from sqlalchemy import text
+from sqlalchemy import select, text
 
 # from backend.metrics import init_db, log_event, get_call_id  # <- use helper
 from backend.metrics import (
-    get_or_create_call_id_for_session,  # NEW
-    log_event, close_call, init_db, deactivate_mappings_for_call,
-    resolve_existing_call_id, SessionLocal, Call,
-    set_call_sentiment, engine
+    aget_or_create_call_id_for_session,  # NEW
+    log_event, aclose_call, init_db, adeactivate_mappings_for_call,
+    resolve_existing_call_id, run_db_async, Call,
+    aset_call_sentiment, engine
 )
 import uuid
 import os
+import logging
+
+try:
+    import orjson
+    _json_loads = orjson.loads
+except ImportError:  # stdlib fallback if orjson isn't installed
+    import json
+    _json_loads = json.loads
+
+# Quiet by default: transcripts are only ever formatted at DEBUG.
+# LOG_LEVEL applies to this app's loggers (backend.*) only; third-party libraries stay at
+# WARNING, so httpx never logs FMCSA request URLs (they carry the webKey).
+_LOG_LEVEL = os.getenv("LOG_LEVEL", "WARNING").strip().upper()
+logging.basicConfig(level=logging.WARNING)
+if not isinstance(logging.getLevelName(_LOG_LEVEL), int):
+    logging.getLogger(__name__).warning("Unknown LOG_LEVEL %r; using WARNING", _LOG_LEVEL)
+    _LOG_LEVEL = "WARNING"
+logging.getLogger("backend").setLevel(_LOG_LEVEL)
+for _noisy in ("httpx", "httpcore"):
+    logging.getLogger(_noisy).setLevel(logging.WARNING)
+logger = logging.getLogger(__name__)
 
 # --- Initialize app ---
-app = FastAPI()
+# orjson encodes the load lists in /search-loads far faster than the stdlib encoder
+app = FastAPI(default_response_class=ORJSONResponse)
 # CORS (fine to keep; tighten in prod)
 ALLOWED_ORIGINS = os.getenv("ALLOWED_ORIGINS", "https://aayushai.com").split(",")
 app.add_middleware(
@@ -38,6 +64,12 @@ def _startup():
     # Creates tables if they don't exist, works for SQLite and Postgres
     init_db()
 
+@app.on_event("shutdown")
+async def _shutdown():
+    # Release the pooled FMCSA and Redis connections
+    await close_fmcsa_client()
+    await close_redis()
+
 # ---------- NEW: Health check endpoint ----------
 @app.get("/healthz")
 def healthz():
@@ -55,15 +87,17 @@ app.include_router(fmcsa_router, dependencies=[Depends(validate_api_key)])
 def root():
     return {"message": "API is live 🚚"}
 
+# Load lookups are pure in-memory reads of the cached catalog, so these run on the
+# event loop directly; DB work goes through the async metrics helpers (a*).
 @app.get("/load/{load_id}", dependencies=[Depends(validate_api_key)])
-def load_details(load_id: str):
+async def load_details(load_id: str):
     load = get_load_by_id(load_id)
     if load is None:
         raise HTTPException(status_code=404, detail="Load not found")
     return load
 
 @app.get("/search-loads")
-def search_loads(
+async def search_loads(
     origin: Optional[str] = None,
     destination: Optional[str] = None,
     equipment_type: Optional[str] = None,
@@ -79,7 +113,7 @@ def search_loads(
     return {"results": results, "count": len(results)}
 
 @app.post("/suggest-loads", dependencies=[Depends(validate_api_key)])
-def suggest_loads(preferences: dict = Body(...)):
+async def suggest_loads(preferences: dict = Body(...)):
     results = get_top_loads_from_preferences(preferences)
     # ✅ Return key must be "results" so the HappyRobot tool step sees them
     return {"results": results, "count": len(results)}
@@ -90,15 +124,30 @@ class NegotiationRequest(BaseModel):
     carrier_offer: float
 
 @app.post("/negotiate-round", dependencies=[Depends(validate_api_key)])
-def negotiate_round(req: NegotiationRequest, request: Request):
+async def negotiate_round(req: NegotiationRequest, request: Request):
     load = get_load_by_id(req.load_id)
     if not load:
         raise HTTPException(status_code=404, detail="Load not found")
 
+    # Webhook retries that carry an Idempotency-Key get the original response back, before
+    # the call/session is touched: a retried accept/fail must not open a new call. The key is
+    # reserved before the turn runs, so a retry racing the original waits for its response.
+    idempotency_key = request.headers.get("Idempotency-Key")
+    if not idempotency_key:
+        return await _negotiate_round(req, request, load)
+    async with areserve_replay(idempotency_key, req.mc_number, req.load_id) as replay:
+        if replay is not None:
+            return replay
+        result = await _negotiate_round(req, request, load)
+        await aremember_replay(idempotency_key, req.mc_number, req.load_id, result)
+    return result
+
+
+async def _negotiate_round(req: NegotiationRequest, request: Request, load: dict) -> dict:
     # NEW: server-side stable call_id (no client payload change)
-    call_id = get_or_create_call_id_for_session(request, mc_number=req.mc_number)
+    call_id = await aget_or_create_call_id_for_session(request, mc_number=req.mc_number)
 
-    result = update_negotiation_session(
+    result = await aupdate_negotiation_session(
         load_id=req.load_id,
         mc_number=req.mc_number,
         offer=req.carrier_offer,
@@ -119,7 +168,7 @@ def negotiate_round(req: NegotiationRequest, request: Request):
     )
 
     if result.get("status") == "accepted":
-        close_call(
+        await aclose_call(
             call_id,
             outcome="accepted",
             agreed_rate=result.get("agreed_rate"),
@@ -127,8 +176,8 @@ def negotiate_round(req: NegotiationRequest, request: Request):
             mc_number=req.mc_number
         )
         # Optional: prevent accidental reuse after closure
-        deactivate_mappings_for_call(call_id)
-        reset_session(req.mc_number, req.load_id, call_id)
+        await adeactivate_mappings_for_call(call_id)
+        await areset_session(req.mc_number, req.load_id, call_id)
 
     else:
     # Safely catch “failed” terminals without assumptions
@@ -142,14 +191,15 @@ def negotiate_round(req: NegotiationRequest, request: Request):
         )
 
         if failed_terminal:
-            close_call(
+            await aclose_call(
                 call_id,
                 outcome="unbooked",
                 load_id=req.load_id,
                 mc_number=req.mc_number
             )
-            deactivate_mappings_for_call(call_id)
-            reset_session(req.mc_number, req.load_id, call_id)
+            await adeactivate_mappings_for_call(call_id)
+            await areset_session(req.mc_number, req.load_id, call_id)
+
     return result
 
 
@@ -160,6 +210,11 @@ class CallSummaryPayload(BaseModel):
     agreed_rate: Optional[float] = None
     transcript: Optional[Any] = None
 
+_SENTIMENTS = {
+    "positive_tag": "positive", "neutral_tag": "neutral", "negative_tag": "negative",
+    "positive": "positive", "neutral": "neutral", "negative": "negative",
+}
+
 def _extract_sentiment_from_transcript(transcript) -> str | None:
     """
     HappyRobot sends events like:
@@ -168,63 +223,66 @@ def _extract_sentiment_from_transcript(transcript) -> str | None:
     """
     try:
         if isinstance(transcript, str):
-            import json
-            transcript = json.loads(transcript)
+            transcript = _json_loads(transcript)
     except Exception:
         return None
 
     if not isinstance(transcript, list):
         return None
 
-    last = None
-    for item in transcript:
+    # Walk backwards: the first valid tag from the end is the last one said
+    for item in reversed(transcript):
         if not isinstance(item, dict):
             continue
         if item.get("role") == "event" and item.get("name") == "sentiment_hr":
-            tag = (item.get("content") or "").strip().lower()
-            if tag.endswith("_tag"):
-                tag = tag[:-4]           # "positive_tag" -> "positive"
-            if tag in {"positive", "neutral", "negative"}:
-                last = tag
-    return last
+            tag = _SENTIMENTS.get((item.get("content") or "").strip().lower())
+            if tag:
+                return tag
+    return None
+
+
+def _find_summary_call_id(conn, mc_number: Optional[str], load_id: Optional[str]) -> Optional[str]:
+    """DB lookup for call_summary; runs via run_db_async."""
+    if mc_number and load_id:
+        cid = conn.scalar(
+            select(Call.call_id)
+            .where(Call.mc_number == mc_number,
+                   Call.load_id == load_id)
+            .order_by(Call.started_at.desc())
+            .limit(1)
+        )
+        if cid:
+            return cid
+    # (Optional) fallback: most-recent call for mc_number
+    if mc_number:
+        cid = conn.scalar(
+            select(Call.call_id)
+            .where(Call.mc_number == mc_number)
+            .order_by(Call.started_at.desc())
+            .limit(1)
+        )
+        if cid:
+            return cid
+    return None
 
 
 @app.post("/webhooks/happyrobot/call-summary", dependencies=[Depends(validate_api_key)])
 async def call_summary(payload: CallSummaryPayload, request: Request):
     ts = datetime.utcnow().isoformat()
-    print("---- HAPPY ROBOT CALL SUMMARY ----")
-    print(f"Timestamp: {ts}")
-    print(f"MC Number: {payload.mc_number}")
-    print(f"Load ID: {payload.load_id}")
-    print(f"Agreed Rate: {payload.agreed_rate}")
-    print(f"Transcript: {payload.transcript}")
+    transcript = payload.transcript
+    logger.info(
+        "call summary mc=%s load=%s agreed_rate=%s transcript_len=%d",
+        payload.mc_number, payload.load_id, payload.agreed_rate,
+        len(transcript) if isinstance(transcript, (str, list)) else 0,
+    )
+    logger.debug("call summary transcript: %s", transcript)  # lazy: not stringified unless DEBUG
 
     # Find the most-recent call for (mc_number, load_id) — regardless of outcome
-    call_id = None
     try:
-        with SessionLocal() as s:
-            if payload.mc_number and payload.load_id:
-                c = (
-                    s.query(Call)
-                     .filter(Call.mc_number == payload.mc_number,
-                             Call.load_id == payload.load_id)
-                     .order_by(Call.started_at.desc())
-                     .first()
-                )
-                if c:
-                    call_id = c.call_id
-            # (Optional) fallback: most-recent call for mc_number
-            if not call_id and payload.mc_number:
-                c = (
-                    s.query(Call)
-                     .filter(Call.mc_number == payload.mc_number)
-                     .order_by(Call.started_at.desc())
-                     .first()
-                )
-                if c:
-                    call_id = c.call_id
-    except Exception as e:
-        print(f"Summary call lookup error: {e}")
+        call_id = await run_db_async(_find_summary_call_id, payload.mc_number, payload.load_id)
+    except Exception:
+        logger.exception("Summary call lookup error")
+        call_id = None
 
     if call_id:
         # Keep transcript in events (safe: existing call_id; won't create new calls)
@@ -242,7 +300,7 @@ async def call_summary(payload: CallSummaryPayload, request: Request):
         # NEW: sentiment → calls.sentiment (even if the call is already accepted)
         sentiment = _extract_sentiment_from_transcript(payload.transcript)
         if sentiment:
-            set_call_sentiment(call_id, sentiment)
+            await aset_call_sentiment(call_id, sentiment)
 
     # Do NOT close/accept anything here (negotiation already did it)
     return {"ok": True, "received_at": ts, "call_id": call_id}
@@ -2,13 +2,42 @@ from __future__ import annotations
 import json
 from datetime import datetime
 from typing import Any, Optional
-from sqlalchemy import create_engine, Column, String, DateTime, Integer, Text, Float, Boolean
-from sqlalchemy.orm import declarative_base, sessionmaker
+from sqlalchemy import create_engine, event, bindparam, func, select, text, Column, String, DateTime, Integer, Text, Float, Boolean, Index, JSON
+from sqlalchemy.dialects.postgresql import JSONB
+from sqlalchemy.orm import declarative_base, sessionmaker, Session
 from sqlalchemy.engine.url import make_url
-from sqlalchemy.pool import QueuePool
-import pathlib, os, uuid
+from sqlalchemy.ext.compiler import compiles
+from sqlalchemy.sql.expression import FunctionElement
+from sqlalchemy.pool import QueuePool, StaticPool
+import pathlib, os, queue, threading, time, logging, atexit
+from secrets import token_hex
+from cachetools import LRUCache
 from fastapi import HTTPException
 
+try:
+    import orjson
+except ImportError:  # stdlib fallback if orjson isn't installed
+    orjson = None
+
+logger = logging.getLogger(__name__)
+
+# Native handling for datetimes, numpy values and non-str dict keys, so orjson only falls
+# back to the Python-level default=str callback for genuinely unknown types
+_ORJSON_OPTS = (
+    orjson.OPT_NAIVE_UTC | orjson.OPT_SERIALIZE_NUMPY | orjson.OPT_NON_STR_KEYS
+) if orjson is not None else 0
+
+def _dumps(payload: Any) -> str:
+    if orjson is not None:
+        try:
+            return orjson.dumps(payload, default=str, option=_ORJSON_OPTS).decode()
+        except TypeError:  # e.g. ints beyond 64 bits; let the stdlib encoder handle it
+            pass
+    return json.dumps(payload, default=str)
+
+def _loads(raw):
+    return orjson.loads(raw) if orjson is not None else json.loads(raw)
+
 DB_URL = os.getenv("DATABASE_URL", "sqlite:///./metrics.db")
 
 # Ensure SQLite directory exists
@@ -26,29 +55,80 @@ except Exception:
     pass
 
 # Use pre_ping + pooled connections; keep SQLite thread-safety for dev
-_engine_kwargs = dict(future=True, pool_pre_ping=True)
+# JSON columns (payload_json) go through the same orjson encoder as log_event
+_engine_kwargs = dict(future=True, pool_pre_ping=True, json_serializer=_dumps, json_deserializer=_loads)
+# Pool settings that apply to the sync `engine` only (the async engine keeps _engine_kwargs')
+_sync_pool_overrides = {}
 try:
     url = make_url(DB_URL)
-    if url.drivername.startswith("sqlite"):
+    if url.drivername.startswith("sqlite") and url.database in (None, "", ":memory:"):
+        # In-memory SQLite lives inside one connection: share it across threads
+        _engine_kwargs["connect_args"] = {"check_same_thread": False}
+        _engine_kwargs["poolclass"] = StaticPool
+    elif url.drivername.startswith("sqlite"):
         _engine_kwargs["connect_args"] = {"check_same_thread": False}
         _engine_kwargs["poolclass"] = QueuePool
         _engine_kwargs["pool_size"] = int(os.getenv("DB_POOL_SIZE", "5"))
         _engine_kwargs["max_overflow"] = int(os.getenv("DB_POOL_MAX_OVERFLOW", "5"))
     else:
+        # Per-process budget against a small RDS (db.t3.micro allows ~80 connections):
+        # 2 API workers x (10+5 async + 2+2 sync) + the dashboard's 2+2 = 42 at most.
+        # Raise DB_POOL_SIZE/DB_POOL_MAX_OVERFLOW (-1 = unbounded) only with a bigger instance.
         _engine_kwargs["poolclass"] = QueuePool
-        _engine_kwargs["pool_size"] = int(os.getenv("DB_POOL_SIZE", "5"))
-        _engine_kwargs["max_overflow"] = int(os.getenv("DB_POOL_MAX_OVERFLOW", "10"))
+        _engine_kwargs["pool_size"] = int(os.getenv("DB_POOL_SIZE", "10"))
+        _engine_kwargs["max_overflow"] = int(os.getenv("DB_POOL_MAX_OVERFLOW", "5"))
+        _engine_kwargs["pool_timeout"] = float(os.getenv("DB_POOL_TIMEOUT", "10"))
+        _engine_kwargs["pool_recycle"] = int(os.getenv("DB_POOL_RECYCLE", "1800"))  # below RDS/proxy idle cutoffs
+        if url.get_driver_name() == "psycopg2":
+            # executemany (event/call batches) as multi-row VALUES, UPDATEs via execute_batch
+            _engine_kwargs["executemany_mode"] = "values_plus_batch"
+        # The sync engine only backs the event-writer thread, /healthz and the dashboard:
+        # a second burst-sized pool per process would exhaust small RDS max_connections
+        _sync_pool_overrides["pool_size"] = int(os.getenv("DB_SYNC_POOL_SIZE", "2"))
+        _sync_pool_overrides["max_overflow"] = int(os.getenv("DB_SYNC_POOL_MAX_OVERFLOW", "2"))
 except Exception:
     pass
 
-engine = create_engine(DB_URL, **_engine_kwargs)
+engine = create_engine(DB_URL, **{**_engine_kwargs, **_sync_pool_overrides})
+
+if engine.dialect.name == "sqlite":
+    @event.listens_for(engine, "connect")
+    def _sqlite_pragmas(dbapi_conn, _record):
+        # Per connection: WAL lets the dashboard read while the API writes, NORMAL skips
+        # most fsyncs, and temp tables/page cache/mmap stay in memory
+        cur = dbapi_conn.cursor()
+        cur.execute("PRAGMA journal_mode=WAL")
+        cur.execute("PRAGMA synchronous=NORMAL")
+        cur.execute("PRAGMA temp_store=MEMORY")
+        cur.execute("PRAGMA mmap_size=268435456")   # 256 MiB
+        cur.execute("PRAGMA cache_size=-65536")     # 64 MiB
+        cur.close()
+
 SessionLocal = sessionmaker(bind=engine, expire_on_commit=False, future=True)
 Base = declarative_base()
 
+class utcnow(FunctionElement):
+    """Naive-UTC "now" evaluated by the database, matching the columns' datetime.utcnow() values."""
+    type = DateTime()
+    inherit_cache = True
+
+@compiles(utcnow)
+def _utcnow_default(element, compiler, **kw):
+    return "CURRENT_TIMESTAMP"
+
+@compiles(utcnow, "postgresql")
+def _utcnow_pg(element, compiler, **kw):
+    return "TIMEZONE('utc', CURRENT_TIMESTAMP)"
+
+@compiles(utcnow, "sqlite")
+def _utcnow_sqlite(element, compiler, **kw):
+    # CURRENT_TIMESTAMP is whole seconds; keep sub-second order for "newest call" lookups
+    return "STRFTIME('%Y-%m-%d %H:%M:%f', 'now')"
+
 class Call(Base):
     __tablename__ = "calls"
     call_id = Column(String, primary_key=True)
-    started_at = Column(DateTime, nullable=False)
+    started_at = Column(DateTime, nullable=False, server_default=utcnow())
     ended_at = Column(DateTime)
     mc_number = Column(String)
     load_id = Column(String)
@@ -56,61 +136,217 @@ class Call(Base):
     outcome = Column(String)
     sentiment = Column(String)
 
+    __table_args__ = (
+        # call-summary lookup: newest call for (mc_number, load_id), then for mc_number alone
+        Index("ix_calls_mc_load_started", "mc_number", "load_id", "started_at"),
+        Index("ix_calls_mc_started", "mc_number", "started_at"),
+        # dashboard: outcome counts, and AVG(agreed_rate) over accepted calls read from the index alone
+        Index("ix_calls_outcome", "outcome"),
+        Index("ix_calls_accepted", "agreed_rate",
+              sqlite_where=text("outcome = 'accepted'"), postgresql_where=text("outcome = 'accepted'")),
+    )
+
+
 class Event(Base):
     __tablename__ = "events"
     id = Column(Integer, primary_key=True, autoincrement=True)
-    call_id = Column(String, index=True, nullable=False)
+    call_id = Column(String, nullable=False)
     ts = Column(DateTime, nullable=False)
     event_type = Column(String, nullable=False)
     ok = Column(Boolean, default=True)
     latency_ms = Column(Integer)
-    payload_json = Column(Text)
+    # Native JSON (JSONB on Postgres) so payload fields can be filtered/aggregated in SQL
+    payload_json = Column(JSON().with_variant(JSONB(), "postgresql"))
+
+    __table_args__ = (
+        # per-call event timelines; the call_id prefix also serves plain call_id lookups
+        Index("ix_events_call_ts", "call_id", "ts"),
+        # dashboard: recent events of a few types, newest first
+        Index("ix_events_type_ts", "event_type", "ts"),
+        # payload_json->>'mc_number' lookups (Postgres only)
+        Index("ix_events_payload_mc", text("(payload_json ->> 'mc_number')")).ddl_if(dialect="postgresql"),
+    )
 
 # NEW: server-side session mapping to keep one call_id per sales call
 class CallKey(Base):
     __tablename__ = "call_keys"
     session_key = Column(String, primary_key=True)   # derived from headers / mc_number
-    call_id = Column(String, nullable=False)
-    created_at = Column(DateTime, nullable=False, default=datetime.utcnow)
+    call_id = Column(String, nullable=False, index=True)  # deactivate_mappings_for_call filters on it
+    created_at = Column(DateTime, nullable=False, default=utcnow(), server_default=utcnow())
     active = Column(Boolean, nullable=False, default=True)
 
 def init_db() -> None:
     Base.metadata.create_all(engine)
+    # create_all only builds indexes along with new tables; add missing ones to existing DBs
+    for table in Base.metadata.sorted_tables:
+        for index in table.indexes:
+            try:
+                index.create(engine, checkfirst=True)
+            except Exception:
+                # e.g. the payload_json expression index on a pre-JSONB (TEXT) events table
+                logger.warning("Skipping index %s", index.name, exc_info=True)
 
 def ensure_call(session, call_id: str, mc_number: Optional[str] = None) -> Call:
     c = session.get(Call, call_id)
     if not c:
-        c = Call(call_id=call_id, started_at=datetime.utcnow(), mc_number=mc_number)
+        c = Call(call_id=call_id, started_at=utcnow(), mc_number=mc_number)
         session.add(c)
     else:
         if mc_number and not c.mc_number:
             c.mc_number = mc_number
     return c
 
+# Set-based counterpart of ensure_call for the event writer: create missing call rows with
+# INSERT ... ON CONFLICT DO NOTHING (no SELECT first), then fill mc_number where it's NULL
+if engine.dialect.name == "postgresql":
+    from sqlalchemy.dialects.postgresql import insert as _dialect_insert
+elif engine.dialect.name == "sqlite":
+    from sqlalchemy.dialects.sqlite import insert as _dialect_insert
+else:
+    _dialect_insert = None
+
+_calls = Call.__table__
+# started_at is always given explicitly: tables created before it had a server_default
+# would otherwise reject the row
+_INSERT_CALL = (
+    _dialect_insert(_calls).values(started_at=utcnow()).on_conflict_do_nothing(index_elements=["call_id"])
+    if _dialect_insert is not None else None
+)
+_FILL_CALL_MC = (
+    _calls.update()
+    .where(_calls.c.call_id == bindparam("b_call_id"), _calls.c.mc_number.is_(None))
+    .values(mc_number=bindparam("b_mc_number"))
+)
+
+def ensure_calls(conn, mc_by_call: dict) -> None:
+    """Make sure a calls row exists for every call_id in {call_id: mc_number} (Core only)."""
+    if not mc_by_call:
+        return
+    rows = [{"call_id": call_id, "mc_number": mc_number} for call_id, mc_number in mc_by_call.items()]
+    if _INSERT_CALL is not None:
+        conn.execute(_INSERT_CALL, rows)
+    else:  # other dialects: insert only the ids that aren't there yet
+        existing = set(conn.execute(
+            select(_calls.c.call_id).where(_calls.c.call_id.in_(list(mc_by_call)))
+        ).scalars())
+        rows = [r for r in rows if r["call_id"] not in existing]
+        if rows:
+            conn.execute(_calls.insert().values(started_at=utcnow()), rows)
+    fills = [{"b_call_id": call_id, "b_mc_number": mc_number}
+             for call_id, mc_number in mc_by_call.items() if mc_number]
+    if fills:
+        conn.execute(_FILL_CALL_MC, fills)
+
+# --- Batched event writer: log_event() only enqueues, a daemon thread commits in batches ---
+EVENT_BATCH_MAX = int(os.getenv("EVENT_BATCH_MAX", "200"))
+EVENT_BATCH_MS = int(os.getenv("EVENT_BATCH_MS", "50"))
+
+_event_queue: "queue.Queue[tuple[dict, Optional[str]]]" = queue.Queue()
+_writer_thread: Optional[threading.Thread] = None
+_writer_lock = threading.Lock()
+
+# Calls already known to exist (with an mc_number) in the DB, so repeat events skip
+# the ensure_call SELECT. Bounded LRU; an evicted call just pays one extra lookup.
+_KNOWN_CALLS: LRUCache = LRUCache(maxsize=10_000)
+_known_calls_lock = threading.Lock()
+
+def _start_event_writer() -> None:
+    global _writer_thread
+    with _writer_lock:
+        if _writer_thread is None or not _writer_thread.is_alive():
+            _writer_thread = threading.Thread(target=_event_writer_loop, name="event-writer", daemon=True)
+            _writer_thread.start()
+
+def _drain_batch() -> list:
+    batch = [_event_queue.get()]  # block until there is work
+    deadline = time.monotonic() + EVENT_BATCH_MS / 1000
+    while len(batch) < EVENT_BATCH_MAX:
+        remaining = deadline - time.monotonic()
+        if remaining <= 0:
+            break
+        try:
+            batch.append(_event_queue.get(timeout=remaining))
+        except queue.Empty:
+            break
+    return batch
+
+def _write_events(batch: list) -> None:
+    # Upsert the distinct, not-yet-known calls in the batch, then a single INSERT + COMMIT
+    mc_by_call: dict = {}
+    with _known_calls_lock:
+        for row, mc_number in batch:
+            call_id = row["call_id"]
+            if call_id not in _KNOWN_CALLS and not mc_by_call.get(call_id):
+                mc_by_call[call_id] = mc_number
+    # Plain Core connection: no Session, identity map or unit-of-work for write-only rows
+    with engine.begin() as conn:
+        ensure_calls(conn, mc_by_call)
+        conn.execute(_INSERT_EVENTS, [row for row, _ in batch])
+    # Only remember calls once committed; calls without an mc_number stay unknown so a
+    # later event can still backfill it
+    with _known_calls_lock:
+        for call_id, mc_number in mc_by_call.items():
+            if mc_number:
+                _KNOWN_CALLS[call_id] = True
+
+# payload_json arrives already encoded by log_event; bind it as text so the JSON type
+# doesn't encode it a second time (the database parses it into JSON/JSONB)
+_INSERT_EVENTS = Event.__table__.insert().values(payload_json=bindparam("payload_json", type_=Text))
+
+def _event_writer_loop() -> None:
+    while True:
+        batch = _drain_batch()
+        try:
+            _write_events(batch)
+        except Exception:
+            logger.exception("Dropped %d events: batch write failed", len(batch))
+        finally:
+            for _ in batch:
+                _event_queue.task_done()
+
+def flush_events() -> None:
+    """Block until every queued event has been written (tests, shutdown)."""
+    _event_queue.join()
+
+@atexit.register
+def _flush_on_exit() -> None:
+    # The writer is a daemon thread; don't let interpreter exit drop queued events
+    if _writer_thread is not None and _writer_thread.is_alive():
+        flush_events()
+
 def log_event(call_id: str, event_type: str, payload: Any, ok: bool = True, latency_ms: Optional[int] = None) -> None:
-    with SessionLocal() as s:
-        ensure_call(s, call_id, mc_number=(payload or {}).get("mc_number"))
-        e = Event(
-            call_id=call_id,
-            ts=datetime.utcnow(),
-            event_type=event_type,
-            ok=ok,
-            latency_ms=latency_ms,
-            payload_json=json.dumps(payload, default=str),
-        )
-        s.add(e)
-        s.commit()
+    """Queue an event for the background writer; returns without touching the DB."""
+    _start_event_writer()
+    row = dict(
+        call_id=call_id,
+        ts=datetime.utcnow(),
+        event_type=event_type,
+        ok=ok,
+        latency_ms=latency_ms,
+        payload_json=_dumps(payload),  # serialize now so later mutation of payload can't leak in
+    )
+    _event_queue.put_nowait((row, (payload or {}).get("mc_number")))
+
+def _close_call(conn, call_id: str, *, outcome: Optional[str] = None, sentiment: Optional[str] = None,
+                agreed_rate: Optional[float] = None, load_id: Optional[str] = None, mc_number: Optional[str] = None) -> None:
+    values = {"ended_at": utcnow()}
+    if outcome: values["outcome"] = outcome
+    if sentiment: values["sentiment"] = sentiment
+    if agreed_rate is not None: values["agreed_rate"] = agreed_rate
+    if load_id: values["load_id"] = load_id
+    if mc_number: values["mc_number"] = func.coalesce(_calls.c.mc_number, mc_number)  # fill, don't overwrite
+    stmt = _calls.update().where(_calls.c.call_id == call_id).values(**values)
+    # Single UPDATE in the common case; no SELECT + ORM mutate
+    if conn.execute(stmt).rowcount == 0:
+        # Row not written yet (e.g. its first event is still queued): create it, then apply
+        ensure_calls(conn, {call_id: mc_number})
+        conn.execute(stmt)
 
 def close_call(call_id: str, *, outcome: Optional[str] = None, sentiment: Optional[str] = None,
                agreed_rate: Optional[float] = None, load_id: Optional[str] = None, mc_number: Optional[str] = None) -> None:
-    with SessionLocal() as s:
-        c = ensure_call(s, call_id, mc_number=mc_number)
-        c.ended_at = datetime.utcnow()
-        if outcome: c.outcome = outcome
-        if sentiment: c.sentiment = sentiment
-        if agreed_rate is not None: c.agreed_rate = agreed_rate
-        if load_id: c.load_id = load_id
-        s.commit()
+    with engine.begin() as conn:
+        _close_call(conn, call_id, outcome=outcome, sentiment=sentiment,
+                    agreed_rate=agreed_rate, load_id=load_id, mc_number=mc_number)
 
 # --- Existing header-based helper (keep for future use) ---
 CALL_ID_HEADER = "X-HR-Call-ID"
@@ -120,8 +356,7 @@ def get_call_id(request, *, generate_if_missing: bool = False) -> str:
         return cid
     if generate_if_missing:
         # only the very first endpoint in the call flow should enable this
-        import uuid
-        return str(uuid.uuid4())
+        return token_hex(16)
     raise HTTPException(status_code=400, detail=f"Missing {CALL_ID_HEADER} header")
 
 # ---------------------------
@@ -137,12 +372,21 @@ POSSIBLE_SESSION_HEADERS = [
     "X-Session-ID",
 ]
 
+# raw (ASGI, already lowercased) header name -> (priority, canonical name used in the key)
+_SESSION_HDR_RANK = {h.lower().encode("latin-1"): (i, h) for i, h in enumerate(POSSIBLE_SESSION_HEADERS)}
+
 def derive_session_key(request, mc_number: Optional[str]) -> str:
-    # 1) Try known conversation/session headers
-    for h in POSSIBLE_SESSION_HEADERS:
-        v = request.headers.get(h)
+    # 1) Try known conversation/session headers: one pass over the raw header bytes (no
+    #    str decoding of unrelated headers), keeping the first value per name; the
+    #    highest-priority non-empty one wins
+    found = {}
+    for k, v in request.headers.raw:
+        hit = _SESSION_HDR_RANK.get(k)
+        if hit and hit not in found:
+            found[hit] = v
+    for (_, h), v in sorted(found.items()):
         if v:
-            return f"hdr:{h}:{v}"
+            return f"hdr:{h}:{v.decode('latin-1')}"
     # 2) Fallback: MC number (assumes 1 active call per MC at a time)
     if mc_number:
         return f"mc:{mc_number}"
@@ -150,45 +394,139 @@ def derive_session_key(request, mc_number: Optional[str]) -> str:
     ip = request.headers.get("X-Forwarded-For") or (request.client.host if getattr(request, "client", None) else "unknown")
     return f"ip:{ip}"
 
-def get_or_create_call_id_for_session(request, mc_number: Optional[str]) -> str:
-    """Return a stable call_id for this sales call without requiring HR to send one."""
-    sk = derive_session_key(request, mc_number)
-    with SessionLocal() as s:
-        row = s.get(CallKey, sk)
+_call_keys = CallKey.__table__
+
+# Point a session_key at a call_id in one statement (merge() would SELECT first).
+# Like merge, an existing row keeps its original created_at.
+if _dialect_insert is not None:
+    _upsert = _dialect_insert(_call_keys)
+    _UPSERT_CALL_KEY = _upsert.values(created_at=utcnow()).on_conflict_do_update(
+        index_elements=["session_key"],
+        set_={"call_id": _upsert.excluded.call_id, "active": _upsert.excluded.active},
+    )
+else:
+    _UPSERT_CALL_KEY = None
+
+def _call_id_for_session_key(conn, sk: str, mc_number: Optional[str], *, force_new: bool = False) -> str:
+    # Runs on a sync Connection, so the async helpers can share it via run_sync()
+    if not force_new:
+        row = conn.execute(
+            select(_call_keys.c.call_id, _call_keys.c.active).where(_call_keys.c.session_key == sk)
+        ).first()
         if row and row.active:
             return row.call_id
+    cid = token_hex(16)  # 128-bit random id, no UUID formatting
+    ensure_calls(conn, {cid: mc_number})
+    # upsert mapping to point this session_key at the new call_id
+    if _UPSERT_CALL_KEY is not None:
+        conn.execute(_UPSERT_CALL_KEY, {"session_key": sk, "call_id": cid, "active": True})
+    else:
+        with Session(bind=conn) as s:
+            s.merge(CallKey(session_key=sk, call_id=cid, active=True))
+            s.flush()
+    return cid
 
-        cid = str(uuid.uuid4())
-        ensure_call(s, cid, mc_number=mc_number)
-        s.merge(CallKey(session_key=sk, call_id=cid, active=True))
-        s.commit()
-        return cid
+def get_or_create_call_id_for_session(request, mc_number: Optional[str]) -> str:
+    """Return a stable call_id for this sales call without requiring HR to send one."""
+    sk = derive_session_key(request, mc_number)
+    with engine.begin() as conn:
+        return _call_id_for_session_key(conn, sk, mc_number)
 
 def start_new_call_session(request, mc_number: Optional[str]) -> str:
     """Force a fresh call_id for a new inbound call (e.g., at FMCSA verify)."""
     sk = derive_session_key(request, mc_number)
-    with SessionLocal() as s:
-        cid = str(uuid.uuid4())
-        ensure_call(s, cid, mc_number=mc_number)
-        # upsert mapping to point this session_key at the new call_id
-        s.merge(CallKey(session_key=sk, call_id=cid, active=True))
-        s.commit()
-        return cid
+    with engine.begin() as conn:
+        return _call_id_for_session_key(conn, sk, mc_number, force_new=True)
+
+def _sentiment_stmt(call_id: str, sentiment: str):
+    # No-op for unknown call_ids, as before
+    return _calls.update().where(_calls.c.call_id == call_id).values(sentiment=sentiment)
 
 def set_call_sentiment(call_id: str, sentiment: str) -> None:
     """Set sentiment on the call without closing or changing outcome."""
-    with SessionLocal() as s:
-        c = s.get(Call, call_id)
-        if not c:
-            return
-        c.sentiment = sentiment
-        s.commit()
+    with engine.begin() as conn:
+        conn.execute(_sentiment_stmt(call_id, sentiment))
+
+def _deactivate_stmt(call_id: str):
+    return (_call_keys.update()
+            .where(_call_keys.c.call_id == call_id, _call_keys.c.active == True)
+            .values(active=False))
 
 def deactivate_mappings_for_call(call_id: str) -> None:
     """Mark mappings to this call_id inactive once the call is closed."""
-    with SessionLocal() as s:
-        s.query(CallKey).filter(CallKey.call_id == call_id, CallKey.active == True).update({"active": False})
-        s.commit()
+    with engine.begin() as conn:
+        conn.execute(_deactivate_stmt(call_id))
+
+# --- Async variants for the FastAPI endpoints (aiosqlite / asyncpg) ---
+# Same statements as the sync helpers above, run on an AsyncEngine so request handlers
+# don't tie up threadpool workers. The engine is built on first use, so importing this
+# module (dashboard, scripts) doesn't need the async drivers.
+_ASYNC_DRIVERS = {"sqlite": "sqlite+aiosqlite", "postgresql": "postgresql+asyncpg"}
+_async_engine = None
+_async_engine_lock = threading.Lock()
+
+def _build_async_engine():
+    from sqlalchemy.ext.asyncio import create_async_engine
+    from sqlalchemy.pool import AsyncAdaptedQueuePool
+    url = engine.url.set(drivername=_ASYNC_DRIVERS[engine.dialect.name])
+    kwargs = {k: v for k, v in _engine_kwargs.items() if k not in ("future", "executemany_mode")}
+    if kwargs.get("poolclass") is QueuePool:
+        kwargs["poolclass"] = AsyncAdaptedQueuePool
+    if url.drivername == "postgresql+asyncpg" and "sslmode" in url.query:
+        # asyncpg spells libpq's sslmode as ssl
+        kwargs["connect_args"] = {**kwargs.get("connect_args", {}), "ssl": url.query["sslmode"]}
+        url = url.difference_update_query(["sslmode"])
+    aengine = create_async_engine(url, **kwargs)
+    if engine.dialect.name == "sqlite":
+        event.listen(aengine.sync_engine, "connect", _sqlite_pragmas)
+    return aengine
+
+def get_async_engine():
+    """AsyncEngine on the same database as `engine`; None if there's no async twin for it."""
+    global _async_engine
+    if _async_engine is None:
+        # An in-memory SQLite DB lives in the sync engine's one connection; an async
+        # engine would open a different, empty database
+        if engine.dialect.name not in _ASYNC_DRIVERS or engine.url.database in (None, "", ":memory:"):
+            return None
+        with _async_engine_lock:
+            if _async_engine is None:
+                _async_engine = _build_async_engine()
+    return _async_engine
+
+async def run_db_async(fn, *args, **kwargs):
+    """Run fn(conn, *args, **kwargs) on a sync-style Connection inside one transaction.
+
+    Uses the async engine via run_sync(); falls back to a worker thread against the
+    sync engine when there is no async engine for this database.
+    """
+    aengine = get_async_engine()
+    if aengine is None:
+        from starlette.concurrency import run_in_threadpool
+        def _sync():
+            with engine.begin() as conn:
+                return fn(conn, *args, **kwargs)
+        return await run_in_threadpool(_sync)
+    async with aengine.begin() as conn:
+        return await conn.run_sync(fn, *args, **kwargs)
+
+async def aget_or_create_call_id_for_session(request, mc_number: Optional[str]) -> str:
+    sk = derive_session_key(request, mc_number)
+    return await run_db_async(_call_id_for_session_key, sk, mc_number)
+
+async def astart_new_call_session(request, mc_number: Optional[str]) -> str:
+    sk = derive_session_key(request, mc_number)
+    return await run_db_async(_call_id_for_session_key, sk, mc_number, force_new=True)
+
+async def aclose_call(call_id: str, **fields) -> None:
+    """Async close_call; same keyword arguments."""
+    await run_db_async(_close_call, call_id, **fields)
+
+async def aset_call_sentiment(call_id: str, sentiment: str) -> None:
+    await run_db_async(lambda conn: conn.execute(_sentiment_stmt(call_id, sentiment)))
+
+async def adeactivate_mappings_for_call(call_id: str) -> None:
+    await run_db_async(lambda conn: conn.execute(_deactivate_stmt(call_id)))
 
 
 def resolve_existing_call_id(request, mc_number: Optional[str], load_id: Optional[str] = None) -> Optional[str]:
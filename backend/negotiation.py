@@ -1,17 +1,52 @@
 # negotiation.py
 from __future__ import annotations
 
-from dataclasses import dataclass, field
-from datetime import datetime
-from typing import Dict, Any, List, Optional
-
-# In-memory sessions; key includes per-call session_id to avoid cross-call contamination
-NEGOTIATION_SESSIONS: Dict[str, "NegotiationSession"] = {}
+import asyncio
+import logging
+import math
+import os
+import threading
+import time
+import uuid
+from contextlib import asynccontextmanager
+from dataclasses import dataclass, field, fields
+from typing import Dict, Any, List, Optional, Tuple
+
+from cachetools import TTLCache
+
+try:
+    import orjson
+    _json_dumps, _json_loads = orjson.dumps, orjson.loads
+except ImportError:  # stdlib fallback if orjson isn't installed
+    import json
+    _json_dumps, _json_loads = json.dumps, json.loads
+
+logger = logging.getLogger(__name__)
+
+SESSION_TTL_S = 1800
+
+# (session_id or "no-session", mc_number, load_id): hashed as a tuple, never formatted
+SessionKey = Tuple[str, str, str]
+
+# In-memory sessions; key includes per-call session_id to avoid cross-call contamination.
+# Bounded LRU with a sliding TTL: every access re-arms the 30 min timer, so only calls
+# that went quiet (abandoned, no accept/fail → no reset_session) are reclaimed.
+NEGOTIATION_SESSIONS: "TTLCache[SessionKey, NegotiationSession]" = TTLCache(maxsize=50_000, ttl=SESSION_TTL_S)
+_SESSIONS_LOCK = threading.RLock()
+# (Idempotency-Key, mc_number, load_id) -> the /negotiate-round response that request produced.
+# Only an explicit key marks a retry: a carrier repeating the same number is a new turn.
+REPLAY_TTL_S = 300
+_REPLAYS: "TTLCache[tuple, Dict[str, Any]]" = TTLCache(maxsize=50_000, ttl=REPLAY_TTL_S)
+# Per-key asyncio locks held while a keyed turn runs: [lock, holders + waiters], dropped at 0
+_REPLAY_LOCKS: Dict[tuple, list] = {}
+# A Redis in-flight marker outlives a worker that died mid-turn by at most this long
+REPLAY_INFLIGHT_TTL_S = 30
+_REPLAY_POLL_S = 0.05
 
 EPS = 1e-6
 
 
-@dataclass
+@dataclass(slots=True)
 class NegotiationSession:
     mc_number: str
     load_id: str
@@ -22,28 +57,63 @@ class NegotiationSession:
     agreed_rate: Optional[float] = None
     status: str = "ongoing"           # "ongoing" | "accepted" | "failed"
     last_counter_offer: Optional[float] = None
-    created_at: str = field(default_factory=lambda: datetime.utcnow().isoformat())
+    created_at: int = field(default_factory=lambda: int(time.time()))  # epoch seconds (UTC)
+    # (hard_cap, r1, r2, r3 ceilings): fixed by loadboard_rate, so index [r] for round r
+    tolerances: Tuple[float, float, float, float] = field(init=False)
+
+    def __post_init__(self) -> None:
+        base = self.loadboard_rate
+        self.tolerances = (_hard_cap(base), *(_round_tolerance(base, r) for r in (1, 2, 3)))
+
+    def key(self) -> SessionKey:
+        return _session_key(self.mc_number, self.load_id, self.session_id)
+
+
+def _session_key(mc_number: str, load_id: str, session_id: Optional[str]) -> SessionKey:
+    return (session_id or "no-session", mc_number, load_id)
 
-    def key(self) -> str:
-        return f"{self.session_id or 'no-session'}::{self.mc_number}::{self.load_id}"
 
+def _redis_key(key: SessionKey) -> str:
+    # The only place a key is turned into a string: Redis needs one
+    return "neg:" + "::".join(key)
 
-def _session_key(mc_number: str, load_id: str, session_id: Optional[str]) -> str:
-    return f"{session_id or 'no-session'}::{mc_number}::{load_id}"
+
+# Optional shared store: with REDIS_URL set, sessions live in Redis (neg:<sid::mc::load>, same
+# sliding TTL) so every uvicorn worker sees the same negotiation; NEGOTIATION_SESSIONS then
+# only covers Redis being unreachable. Without it, sessions stay process-local as before.
+# Async client: the endpoints await it (aupdate_negotiation_session/areset_session), so a
+# slow or unreachable Redis never blocks the event loop.
+REDIS_URL = os.getenv("REDIS_URL", "").strip()
+_REDIS = None
+if REDIS_URL:
+    import redis.asyncio
+    from redis.exceptions import WatchError
+    _REDIS = redis.asyncio.Redis.from_url(REDIS_URL, socket_timeout=0.25, socket_connect_timeout=0.25)
+# Optimistic-transaction attempts per turn before giving up on Redis for it
+_REDIS_TURN_ATTEMPTS = 5
+
+# Everything except the derived tolerances
+_PERSISTED_FIELDS = tuple(f.name for f in fields(NegotiationSession) if f.init)
+
+
+def _dump_session(session: NegotiationSession) -> bytes:
+    return _json_dumps({name: getattr(session, name) for name in _PERSISTED_FIELDS})
 
 
 def _get_or_create_session(
     mc_number: str, load_id: str, loadboard_rate: float, session_id: Optional[str]
 ) -> NegotiationSession:
     key = _session_key(mc_number, load_id, session_id)
-    sess = NEGOTIATION_SESSIONS.get(key)
-    if not sess:
-        sess = NegotiationSession(
-            mc_number=mc_number,
-            load_id=load_id,
-            loadboard_rate=float(loadboard_rate),
-            session_id=session_id,
-        )
+    with _SESSIONS_LOCK:
+        sess = NEGOTIATION_SESSIONS.get(key)
+        if sess is None:
+            sess = NegotiationSession(
+                mc_number=mc_number,
+                load_id=load_id,
+                loadboard_rate=loadboard_rate,  # already a float (update_negotiation_session casts)
+                session_id=session_id,
+            )
+        # (Re)inserting touches the entry: restarts its TTL and makes it most recently used
         NEGOTIATION_SESSIONS[key] = sess
     return sess
 
@@ -81,6 +151,37 @@ def _hard_cap(base: float) -> float:
     return round(base * 1.15, 2)
 
 
+def _max_acceptable(session: NegotiationSession, round_number: int) -> float:
+    """Precomputed _round_tolerance for this session (same 1..3 clamp)."""
+    return session.tolerances[max(1, min(round_number, 3))]
+
+
+def _build_response(
+    session: NegotiationSession,
+    message: str,
+    status: str,
+    *,
+    round_number: int,
+    max_acceptable: float,
+    agreed_rate: Optional[float] = None,
+    broker_counter: Optional[float] = None,
+) -> Dict[str, Any]:
+    """The one response shape every update_negotiation_session branch returns."""
+    return {
+        "agreed_rate": agreed_rate,
+        "broker_counter_offer": broker_counter,
+        # Immutable snapshot (serializes as a JSON array): safe to share with the replay cache
+        "carrier_offers": tuple(session.carrier_offers),
+        "hard_cap": session.tolerances[0],
+        "load_id": session.load_id,
+        "max_acceptable": max_acceptable,
+        "mc_number": session.mc_number,
+        "message": message,
+        "round_number": round_number,
+        "status": status,
+    }
+
+
 def update_negotiation_session(
     *,
     load_id: str,
@@ -120,55 +221,97 @@ def update_negotiation_session(
         loadboard_rate=float(loadboard_rate),
         session_id=session_id,
     )
-    # If the carrier hasn't given a numeric amount, do NOT accept or progress rounds.
-    # Return a "pending" prompt so the agent asks for digits.
-    if offer is None or (not isinstance(offer, (int, float)) and not str(offer).strip().replace('.', '', 1).isdigit()):
-        base = float(session.loadboard_rate)
-        return {
-            "agreed_rate": None,
-            "broker_counter_offer": None,
-            "carrier_offers": session.carrier_offers[:],
-            "hard_cap": round(base * 1.15, 2),
-            "load_id": session.load_id,
-            "max_acceptable": round(base * (1 + 0.05 * max(1, min(session.round_number or 1, 3))), 2),
-            "mc_number": session.mc_number,
-            "message": "needs_numeric_from_carrier",
-            "round_number": session.round_number or 0,
-            "status": "pending",
-        }
-
-    base = float(session.loadboard_rate)
+    return _negotiate_turn(session, offer)
+
+
+async def aupdate_negotiation_session(
+    *,
+    load_id: str,
+    mc_number: str,
+    offer: float,
+    loadboard_rate: float,
+    session_id: Optional[str] = None,
+) -> Dict[str, Any]:
+    """
+    update_negotiation_session for the async endpoints. With REDIS_URL set, the turn is
+    read-advance-write on the shared session under WATCH/MULTI, so two workers handling
+    the same call can't both advance from the same round; a conflicting write retries.
+    """
+    if _REDIS is None:
+        return update_negotiation_session(
+            load_id=load_id, mc_number=mc_number, offer=offer,
+            loadboard_rate=loadboard_rate, session_id=session_id,
+        )
+    key = _session_key(mc_number, load_id, session_id)
     try:
-        offer = float(offer)
+        return await _redis_turn(key, float(loadboard_rate), offer)
     except Exception:
-        # Non-numeric offers are ignored at this layer
-        return {
-            "agreed_rate": None,
-            "broker_counter_offer": session.last_counter_offer,
-            "carrier_offers": session.carrier_offers[:],
-            "hard_cap": _hard_cap(base),
-            "load_id": session.load_id,
-            "max_acceptable": _round_tolerance(base, max(1, session.round_number)),
-            "mc_number": session.mc_number,
-            "message": "Non-numeric offer ignored",
-            "round_number": session.round_number,
-            "status": session.status,
-        }
+        logger.warning("Redis turn failed for %s; using the local session", key, exc_info=True)
+        return update_negotiation_session(
+            load_id=load_id, mc_number=mc_number, offer=offer,
+            loadboard_rate=loadboard_rate, session_id=session_id,
+        )
 
+
+async def _redis_turn(key: SessionKey, loadboard_rate: float, offer: Any) -> Dict[str, Any]:
+    rkey = _redis_key(key)
+    session_id, mc_number, load_id = key
+    async with _REDIS.pipeline(transaction=True) as pipe:
+        for _ in range(_REDIS_TURN_ATTEMPTS):
+            try:
+                await pipe.watch(rkey)
+                raw = await pipe.get(rkey)
+                if raw:
+                    session = NegotiationSession(**_json_loads(raw))
+                else:
+                    session = NegotiationSession(
+                        mc_number=mc_number, load_id=load_id, loadboard_rate=loadboard_rate,
+                        session_id=None if session_id == "no-session" else session_id,
+                    )
+                result = _negotiate_turn(session, offer)
+                pipe.multi()
+                pipe.set(rkey, _dump_session(session), ex=SESSION_TTL_S)  # also re-arms the TTL
+                await pipe.execute()
+            except WatchError:
+                continue  # another worker moved this call on meanwhile: redo the turn on its state
+            # Keep a local copy warm in case Redis becomes unreachable later in the call
+            with _SESSIONS_LOCK:
+                NEGOTIATION_SESSIONS[key] = session
+            return result
+    raise RuntimeError(f"session {rkey} kept changing under {_REDIS_TURN_ATTEMPTS} attempts")
+
+
+def _negotiate_turn(session: NegotiationSession, offer: Any) -> Dict[str, Any]:
+    """One carrier turn against an already-loaded session (mutates it)."""
+    # One parse decides it: anything that isn't a finite number (None, "abc", nan, inf)
+    # must NOT accept or progress rounds. Return a "pending" prompt so the agent asks for digits.
+    try:
+        offer = float(offer)
+        numeric = math.isfinite(offer)
+    except (TypeError, ValueError):
+        numeric = False
+    if not numeric:
+        return _build_response(
+            session, "needs_numeric_from_carrier", "pending",
+            round_number=session.round_number or 0,
+            max_acceptable=_max_acceptable(session, session.round_number or 1),
+        )
+
+    return _apply_offer(session, offer, session.loadboard_rate)
+
+
+def _apply_offer(session: NegotiationSession, offer: float, base: float) -> Dict[str, Any]:
+    """Advance the session with a numeric carrier offer (rules documented above)."""
     # Idempotency: if already terminal, return as-is
     if session.status in ("accepted", "failed"):
-        return {
-            "agreed_rate": session.agreed_rate,
-            "broker_counter_offer": None if session.status == "accepted" else session.last_counter_offer,
-            "carrier_offers": session.carrier_offers[:],
-            "hard_cap": _hard_cap(base),
-            "load_id": session.load_id,
-            "max_acceptable": _round_tolerance(base, max(1, session.round_number or 1)),
-            "mc_number": session.mc_number,
-            "message": "Session already accepted" if session.status == "accepted" else "Session failed",
-            "round_number": session.round_number,
-            "status": session.status,
-        }
+        accepted = session.status == "accepted"
+        return _build_response(
+            session, "Session already accepted" if accepted else "Session failed", session.status,
+            round_number=session.round_number,
+            max_acceptable=_max_acceptable(session, session.round_number or 1),
+            agreed_rate=session.agreed_rate,
+            broker_counter=None if accepted else session.last_counter_offer,
+        )
 
     # === Acceptance short-circuits (no append here) ===
     # A) Carrier accepts our last broker counter exactly → accept at that price
@@ -176,36 +319,32 @@ def update_negotiation_session(
         session.status = "accepted"
         session.agreed_rate = float(session.last_counter_offer)
         # DO NOT append; the "offer" here is an echo of our counter.
-        return {
-            "agreed_rate": session.agreed_rate,
-            "broker_counter_offer": None,
-            "carrier_offers": session.carrier_offers[:],
-            "hard_cap": _hard_cap(base),
-            "load_id": session.load_id,
-            "max_acceptable": _round_tolerance(base, max(1, session.round_number or 1)),
-            "mc_number": session.mc_number,
-            "message": f"Accepted at {session.agreed_rate:.2f}",
-            "round_number": max(1, session.round_number),  # don't bump on pure acceptance
-            "status": "accepted",
-        }
-
-    # B) Round 0 initial acceptance (offer equals board/base)
-    if session.round_number == 0 and abs(offer - base) < EPS:
+        return _build_response(
+            session, f"Accepted at {session.agreed_rate:.2f}", "accepted",
+            round_number=max(1, session.round_number),  # don't bump on pure acceptance
+            max_acceptable=_max_acceptable(session, session.round_number or 1),
+            agreed_rate=session.agreed_rate,
+        )
+
+    # B) Fast path for the common first offer at or below base: always an acceptance
+    #    at round 1, so skip the round/threshold bookkeeping below
+    if session.round_number == 0 and (offer < base or abs(offer - base) < EPS):
+        if abs(offer - base) < EPS:
+            # Initial acceptance of the board rate: DO NOT append, round stays 0
+            session.agreed_rate = base
+        else:
+            # A real carrier number under base: record it as round 1
+            _append_offer_once(session, offer)
+            session.round_number = 1
+            session.agreed_rate = round(offer, 2)
+            session.last_counter_offer = None
         session.status = "accepted"
-        session.agreed_rate = base
-        # DO NOT append again (initial acceptance path)
-        return {
-            "agreed_rate": session.agreed_rate,
-            "broker_counter_offer": None,
-            "carrier_offers": session.carrier_offers[:],
-            "hard_cap": _hard_cap(base),
-            "load_id": session.load_id,
-            "max_acceptable": _round_tolerance(base, 1),
-            "mc_number": session.mc_number,
-            "message": f"Accepted at {session.agreed_rate:.2f}",
-            "round_number": 1,
-            "status": "accepted",
-        }
+        return _build_response(
+            session, f"Accepted at {session.agreed_rate:.2f}", "accepted",
+            round_number=1,
+            max_acceptable=session.tolerances[1],
+            agreed_rate=session.agreed_rate,
+        )
 
     # === Append exactly once for a real carrier number ===
     # If this is an echo of our last counter, we would have returned above.
@@ -215,64 +354,139 @@ def update_negotiation_session(
     # We increment the round now that we've received a real carrier offer.
     session.round_number = max(1, session.round_number + 1)
     r = max(1, min(session.round_number, 3))
-    max_acceptable = _round_tolerance(base, r)
-    hard_cap = _hard_cap(base)
+    max_acceptable = session.tolerances[r]
 
     # === Accept if within tolerance for this round ===
     if offer <= max_acceptable + EPS:
         session.status = "accepted"
         session.agreed_rate = round(offer, 2)
         session.last_counter_offer = None
-        return {
-            "agreed_rate": session.agreed_rate,
-            "broker_counter_offer": None,
-            "carrier_offers": session.carrier_offers[:],
-            "hard_cap": hard_cap,
-            "load_id": session.load_id,
-            "max_acceptable": max_acceptable,
-            "mc_number": session.mc_number,
-            "message": f"Accepted at {session.agreed_rate:.2f}",
-            "round_number": r,
-            "status": "accepted",
-        }
+        return _build_response(
+            session, f"Accepted at {session.agreed_rate:.2f}", "accepted",
+            round_number=r, max_acceptable=max_acceptable, agreed_rate=session.agreed_rate,
+        )
 
     # === If over tolerance and already at last round, fail ===
     if r >= 3 and offer > max_acceptable + EPS:
         session.status = "failed"
         session.agreed_rate = None
         # Keep last_counter_offer as-is (might be None)
-        return {
-            "agreed_rate": None,
-            "broker_counter_offer": session.last_counter_offer,
-            "carrier_offers": session.carrier_offers[:],
-            "hard_cap": hard_cap,
-            "load_id": session.load_id,
-            "max_acceptable": max_acceptable,
-            "mc_number": session.mc_number,
-            "message": "Reached limit after three rounds.",
-            "round_number": r,
-            "status": "failed",
-        }
+        return _build_response(
+            session, "Reached limit after three rounds.", "failed",
+            round_number=r, max_acceptable=max_acceptable, broker_counter=session.last_counter_offer,
+        )
 
     # === Otherwise, counter at the round tolerance (5% per round over base) ===
     broker_counter = max_acceptable  # deterministic counter to the round’s ceiling
     session.last_counter_offer = broker_counter
 
-    return {
-        "agreed_rate": None,
-        "broker_counter_offer": broker_counter,
-        "carrier_offers": session.carrier_offers[:],
-        "hard_cap": hard_cap,
-        "load_id": session.load_id,
-        "max_acceptable": max_acceptable,
-        "mc_number": session.mc_number,
-        "message": f"Carrier offer too high. Broker countered with {broker_counter:.2f}.",
-        "round_number": r,
-        "status": "ongoing",
-    }
+    return _build_response(
+        session, f"Carrier offer too high. Broker countered with {broker_counter:.2f}.", "ongoing",
+        round_number=r, max_acceptable=max_acceptable, broker_counter=broker_counter,
+    )
 
 def reset_session(mc_number: str, load_id: str, session_id: Optional[str] = None) -> None:
     """Remove the in-memory session for a completed/abandoned call."""
     key = _session_key(mc_number, load_id, session_id)
-    print(key)
-    NEGOTIATION_SESSIONS.pop(key, None)
\ No newline at end of file
+    with _SESSIONS_LOCK:
+        NEGOTIATION_SESSIONS.pop(key, None)
+
+
+async def areset_session(mc_number: str, load_id: str, session_id: Optional[str] = None) -> None:
+    """reset_session, plus the shared copy in Redis when configured."""
+    reset_session(mc_number, load_id, session_id)
+    if _REDIS is not None:
+        try:
+            await _REDIS.delete(_redis_key(_session_key(mc_number, load_id, session_id)))
+        except Exception:
+            logger.warning("Redis delete failed for %s", session_id, exc_info=True)
+
+
+def _replay_key(idempotency_key: str, mc_number: str, load_id: str) -> tuple:
+    return (idempotency_key, mc_number, load_id)
+
+
+@asynccontextmanager
+async def areserve_replay(idempotency_key: str, mc_number: str, load_id: str):
+    """
+    Hold an Idempotency-Key for one /negotiate-round turn.
+
+    Yields the response already stored for the key (return it as-is), or None once the key
+    is reserved: run the turn and aremember_replay() it inside the block. A retry arriving
+    while the turn runs waits for it and then gets its response instead of a second round.
+    Within a process a per-key lock serializes them; with Redis an in-flight marker set with
+    NX does the same across workers. Leaving the block without a stored result releases the key.
+    """
+    key = _replay_key(idempotency_key, mc_number, load_id)
+    entry = _REPLAY_LOCKS.get(key)
+    if entry is None:
+        entry = _REPLAY_LOCKS[key] = [asyncio.Lock(), 0]
+    entry[1] += 1
+    try:
+        async with entry[0]:
+            with _SESSIONS_LOCK:
+                result = _REPLAYS.get(key)
+            if result is not None:
+                yield dict(result)  # callers get their own dict
+                return
+            marker = None
+            if _REDIS is not None:
+                marker, result = await _areserve_redis_replay(key)
+                if result is not None:
+                    yield result
+                    return
+            try:
+                yield None
+            finally:
+                if marker is not None:
+                    await _arelease_redis_replay(key, marker)
+    finally:
+        entry[1] -= 1
+        if not entry[1]:
+            del _REPLAY_LOCKS[key]
+
+
+async def _areserve_redis_replay(key: tuple) -> Tuple[Optional[bytes], Optional[Dict[str, Any]]]:
+    """(our in-flight marker, None) once reserved, or (None, stored response); (None, None) if Redis fails."""
+    rkey = "negreplay:" + "::".join(key)
+    marker = b"inflight:" + uuid.uuid4().hex.encode()
+    try:
+        while True:
+            if await _REDIS.set(rkey, marker, nx=True, ex=REPLAY_INFLIGHT_TTL_S):
+                return marker, None
+            raw = await _REDIS.get(rkey)
+            if raw and not raw.startswith(b"inflight:"):
+                return None, _json_loads(raw)
+            # Another worker holds the key (or it just expired): wait for its response
+            await asyncio.sleep(_REPLAY_POLL_S)
+    except Exception:
+        logger.warning("Redis replay reservation failed for %s", key[0], exc_info=True)
+        return None, None
+
+
+async def _arelease_redis_replay(key: tuple, marker: bytes) -> None:
+    """Drop our in-flight marker unless aremember_replay() already replaced it with the response."""
+    rkey = "negreplay:" + "::".join(key)
+    try:
+        # Only this request writes over its own marker, so GET-then-DELETE cannot race a holder
+        if await _REDIS.get(rkey) == marker:
+            await _REDIS.delete(rkey)
+    except Exception:
+        logger.warning("Redis replay release failed for %s", key[0], exc_info=True)
+
+
+async def aremember_replay(idempotency_key: str, mc_number: str, load_id: str, result: Dict[str, Any]) -> None:
+    key = _replay_key(idempotency_key, mc_number, load_id)
+    with _SESSIONS_LOCK:
+        _REPLAYS[key] = dict(result)
+    if _REDIS is not None:
+        try:
+            await _REDIS.set("negreplay:" + "::".join(key), _json_dumps(result), ex=REPLAY_TTL_S)
+        except Exception:
+            logger.warning("Redis replay write failed for %s", idempotency_key, exc_info=True)
+
+
+async def close_redis() -> None:
+    """Release the Redis connection pool (app shutdown)."""
+    if _REDIS is not None:
+        await _REDIS.aclose()
\ No newline at end of file
@@ -5,18 +5,70 @@ from backend.security import validate_api_key
 from backend.metrics import (
     log_event,
     get_or_create_call_id_for_session,  # NEW
-    close_call,
+    aclose_call,
     deactivate_mappings_for_call,         # NEW (optional, clean up mapping after close)
-    start_new_call_session
+    astart_new_call_session
 )
+import asyncio
 import httpx
 import os
 import time
+from cachetools import TTLCache
+# Shared pooled client (backend.main closes it on shutdown)
+from backend.utils.fmcsa import get_fmcsa_client as _get_client
+
+try:
+    import orjson
+    _json_loads = orjson.loads
+except ImportError:  # stdlib fallback if orjson isn't installed
+    import json
+    _json_loads = json.loads
 
 router = APIRouter(dependencies=[Depends(validate_api_key)])
 
-FMCSA_API_URL = "https://mobile.fmcsa.dot.gov/qc/services/carriers/{mc_number}?webKey={api_key}"
 FMCSA_API_KEY = os.getenv("FMCSA_API_KEY", "")
+# The key is fixed at startup, so the URL is prefix + mc_number + suffix (no per-call .format)
+FMCSA_URL_PREFIX = "https://mobile.fmcsa.dot.gov/qc/services/carriers/"
+FMCSA_URL_SUFFIX = f"?webKey={FMCSA_API_KEY}"
+
+# Carriers FMCSA found (non-empty content), per MC number: authority changes rarely, 1h is plenty
+_FMCSA_CACHE: TTLCache = TTLCache(maxsize=10_000, ttl=3600)
+# "Not found / not eligible" answers (empty content) only briefly: a newly authorised carrier
+# must not be turned away for an hour, but a burst of retries still shares one lookup
+_FMCSA_MISS_CACHE: TTLCache = TTLCache(maxsize=10_000, ttl=60)
+# Single-flight: concurrent lookups of the same MC wait for one HTTP request.
+# mc_number -> [lock, holders + waiters]; the entry goes once the last of them is done
+_FMCSA_LOCKS: dict[str, list] = {}
+
+def _cached_fmcsa(mc_number: str):
+    data = _FMCSA_CACHE.get(mc_number)
+    return data if data is not None else _FMCSA_MISS_CACHE.get(mc_number)
+
+async def _fetch_fmcsa(mc_number: str) -> dict:
+    data = _cached_fmcsa(mc_number)
+    if data is not None:
+        return data
+    entry = _FMCSA_LOCKS.get(mc_number)
+    if entry is None:
+        entry = _FMCSA_LOCKS[mc_number] = [asyncio.Lock(), 0]
+    entry[1] += 1
+    try:
+        async with entry[0]:
+            data = _cached_fmcsa(mc_number)  # filled while we waited?
+            if data is not None:
+                return data
+            url = FMCSA_URL_PREFIX + str(mc_number) + FMCSA_URL_SUFFIX
+            fmcsa_resp = await _get_client().get(url)
+            if fmcsa_resp.status_code != 200:
+                raise HTTPException(status_code=fmcsa_resp.status_code, detail="FMCSA API error")
+            data = _json_loads(fmcsa_resp.content)
+            # errors/timeouts are never cached
+            (_FMCSA_CACHE if data.get("content") else _FMCSA_MISS_CACHE)[mc_number] = data
+            return data
+    finally:
+        entry[1] -= 1
+        if entry[1] == 0:
+            _FMCSA_LOCKS.pop(mc_number, None)
 
 @router.post("/verify-mc")
 async def verify_mc(request: Request):
@@ -27,22 +79,17 @@ async def verify_mc(request: Request):
     if not mc_number:
         raise HTTPException(status_code=400, detail="MC Number is required")
 
-    call_id = start_new_call_session(request, mc_number=mc_number)
+    call_id = await astart_new_call_session(request, mc_number=mc_number)
 
 
     # Call FMCSA API
     try:
-        url = FMCSA_API_URL.format(mc_number=mc_number, api_key=FMCSA_API_KEY)
-        async with httpx.AsyncClient(timeout=8.0) as client:
-            fmcsa_resp = await client.get(url)
-        if fmcsa_resp.status_code != 200:
-            raise HTTPException(status_code=fmcsa_resp.status_code, detail="FMCSA API error")
-        fmcsa_data = fmcsa_resp.json()
-    except httpx.ReadTimeout:
-        # Timeout: log + mark ineligible (so dashboard shows it)
+        fmcsa_data = await _fetch_fmcsa(mc_number)
+    except httpx.TimeoutException:
+        # Timeout (connect, read or pool; the limits live on the shared client): log + mark ineligible (so dashboard shows it)
         latency = int((time.time() - start_time) * 1000)
         log_event(call_id, "fmcsa.verify", {"mc_number": mc_number, "valid": False, "message": "timeout"}, ok=False, latency_ms=latency)
-        close_call(call_id, outcome="ineligible", mc_number=mc_number)
+        await aclose_call(call_id, outcome="ineligible", mc_number=mc_number)
         return {"valid": False, "message": "FMCSA lookup timeout", "call_id": call_id}
 
     # Determine validity (adjust if your verify utility returns a different shape)
@@ -53,7 +100,7 @@ async def verify_mc(request: Request):
 
     if not is_valid:
         # Mark as ineligible so it shows in calls table
-        close_call(call_id, outcome="ineligible", mc_number=mc_number)
+        await aclose_call(call_id, outcome="ineligible", mc_number=mc_number)
         return {"valid": False, "message": "Carrier is not eligible to haul.", "call_id": call_id}
 
     return {"valid": True, "call_id": call_id, "raw": fmcsa_data}
@@ -1,4 +1,5 @@
 # backend/security.py
+import hmac
 import os
 from fastapi import HTTPException, Security
 from fastapi.security.api_key import APIKeyHeader
@@ -17,6 +18,9 @@ if not INTERNAL_API_KEY:
     # Fail fast so you don't accidentally run without auth
     raise RuntimeError("INTERNAL_API_KEY not set in environment")
 
+# Encoded once; compare_digest on bytes also accepts non-ASCII header values
+_INTERNAL_API_KEY_BYTES = INTERNAL_API_KEY.encode()
+
 # FastAPI helper to read the header (no auto 401 so we control the message)
 _api_key_header = APIKeyHeader(name=API_KEY_HEADER_NAME, auto_error=False)
 
@@ -25,6 +29,7 @@ async def validate_api_key(api_key: str = Security(_api_key_header)) -> str:
     Dependency to protect routes.
     Usage: dependencies=[Depends(validate_api_key)]
     """
-    if not api_key or api_key != INTERNAL_API_KEY:
+    # Constant-time compare: response timing doesn't reveal how much of the key matched
+    if not api_key or not hmac.compare_digest(api_key.encode(), _INTERNAL_API_KEY_BYTES):
         raise HTTPException(status_code=401, detail="Unauthorized")
     return api_key
@@ -1,36 +1,29 @@
 # backend/utils/fmcsa.py
 
 import httpx
-import os
-from dotenv import load_dotenv
-
-load_dotenv()
-
-API_KEY = os.getenv("FMCSA_API_KEY")
-BASE_URL = "https://mobile.fmcsa.dot.gov/qc/services/carriers/docket-number"
-
-async def verify_mc_number(mc_number: str):
-    if not mc_number.isdigit():
-        return {"valid": False, "reason": "Invalid MC number format"}
-
-    url = f"{BASE_URL}/{mc_number}"
-    params = { "webKey": API_KEY }
-
-    async with httpx.AsyncClient() as client:
-        response = await client.get(url, params=params)
-
-    if response.status_code != 200:
-        return {"valid": False, "reason": f"FMCSA API error: {response.status_code}"}
-
-    data = response.json()
-    if not data.get("content"):
-        return {"valid": False, "reason": "Carrier not found"}
-
-    carrier_info = data["content"][0].get("carrier", {})
-
-    return {
-        "valid": True,
-        "mc_number": mc_number,
-        "company_name": carrier_info.get("legalName", "Unknown"),
-        "status": carrier_info.get("carrierOperation", {}).get("carrierOperationDesc", "Unknown")
-    }
+from typing import Optional
+
+try:
+    import h2  # noqa: F401  (httpx's optional HTTP/2 support)
+    _HTTP2 = True
+except ImportError:
+    _HTTP2 = False
+
+# One pooled client for the process: keep-alive (and HTTP/2 multiplexing when h2 is installed)
+# instead of a TLS handshake per call. Fail fast on connect; FMCSA itself can be slow to answer.
+FMCSA_CLIENT: Optional[httpx.AsyncClient] = None
+
+def get_fmcsa_client() -> httpx.AsyncClient:
+    global FMCSA_CLIENT
+    if FMCSA_CLIENT is None or FMCSA_CLIENT.is_closed:
+        FMCSA_CLIENT = httpx.AsyncClient(
+            timeout=httpx.Timeout(8.0, connect=2.0),
+            http2=_HTTP2,
+            limits=httpx.Limits(max_keepalive_connections=32, max_connections=64),
+        )
+    return FMCSA_CLIENT
+
+async def close_fmcsa_client() -> None:
+    """Close the shared client (app shutdown); the next request reopens it."""
+    if FMCSA_CLIENT is not None:
+        await FMCSA_CLIENT.aclose()
@@ -10,7 +10,7 @@ Streamlit dashboard for Inbound Carrier Sales metrics (focused on FMCSA + Negoti
 import os
 import sys
 import pandas as pd
-from sqlalchemy import text
+from sqlalchemy import bindparam, text
 import streamlit as st
 
 # Make the project root importable (so "backend.metrics" works without packaging)
@@ -31,7 +31,9 @@ except Exception:
     DB_URL = os.getenv("DATABASE_URL", "sqlite:///./metrics.db")
     engine = create_engine(DB_URL, future=True)
 
-# Create tables if missing (works even if API isn't running yet)
+# Create tables if missing (works even if API isn't running yet).
+# cache_resource: runs once per server process, not on every Streamlit rerun
+@st.cache_resource
 def _ensure_tables():
     # Preferred path: use your backend's ORM initializer (portable for SQLite/Postgres)
     if HAVE_BACKEND:
@@ -82,71 +84,120 @@ def _ensure_tables():
                     payload_json TEXT
                 );
             """))
-
-# Ensure tables once at import 
+        # Same dashboard indexes init_db declares on the models (partial indexes work on both dialects)
+        for ddl in (
+            # recent-events panel: WHERE event_type IN (...) ORDER BY ts DESC LIMIT 100
+            "CREATE INDEX IF NOT EXISTS ix_events_type_ts ON events (event_type, ts)",
+            "CREATE INDEX IF NOT EXISTS ix_events_call_ts ON events (call_id, ts)",
+            "CREATE INDEX IF NOT EXISTS ix_calls_outcome ON calls (outcome)",
+            "CREATE INDEX IF NOT EXISTS ix_calls_accepted ON calls (agreed_rate) WHERE outcome = 'accepted'",
+        ):
+            conn.execute(text(ddl))
+
+# Ensure tables once per process (reruns hit the cache_resource entry)
 _ensure_tables()
 
+# Focus dashboard on FMCSA + negotiation only
+FOCUSED_EVENTS = ("fmcsa.verify", "fmcsa.verification", "nego.round")
+
+# Each tile is a narrow query with the aggregation done in the database, so nothing here
+# scales with the size of calls/events. One connection per refresh serves all of them.
+def _top_tiles(conn):
+    """(total calls, acceptance rate %, avg negotiation rounds) in one round-trip."""
+    total, acc_rate, avg_rounds = conn.execute(text("""
+        WITH rounds AS (
+            SELECT call_id, COUNT(*) AS n FROM events
+            WHERE event_type = 'nego.round' GROUP BY call_id
+        )
+        SELECT
+            (SELECT COUNT(*) FROM calls),
+            -- share of all calls (open ones included) that ended accepted
+            (SELECT AVG(CASE WHEN outcome = 'accepted' THEN 1.0 ELSE 0.0 END) FROM calls),
+            -- averaged only across calls that had at least one nego.round
+            (SELECT AVG(n) FROM rounds)
+    """)).one()
+    return int(total or 0), float(acc_rate or 0.0) * 100, float(avg_rounds or 0.0)
+
+def _counts(conn, column: str) -> pd.Series:
+    """value_counts() of calls.<column> (NULL → "unknown"); empty if the column is all NULL."""
+    df = pd.read_sql(text(f"SELECT {column} AS value, COUNT(*) AS n FROM calls GROUP BY {column}"), conn)
+    if not df["value"].notna().any():
+        return pd.Series(dtype="int64")
+    counts = df.assign(value=df["value"].fillna("unknown")).groupby("value")["n"].sum()
+    return counts.sort_values(ascending=False).rename_axis(column)
+
+def _avg_accepted_rate(conn):
+    avg = conn.execute(text("SELECT AVG(agreed_rate) FROM calls WHERE outcome = 'accepted'")).scalar()
+    return None if avg is None else float(avg)
+
+_RECENT_EVENTS_SQL = text("""
+    SELECT id, call_id, ts, event_type, ok, latency_ms, payload_json FROM events
+    WHERE event_type IN :types ORDER BY ts DESC LIMIT :limit
+""").bindparams(bindparam("types", expanding=True))
+
+def _recent_focused_events(conn, limit: int = 100) -> pd.DataFrame:
+    events = pd.read_sql(_RECENT_EVENTS_SQL, conn, params={"types": list(FOCUSED_EVENTS), "limit": limit})
+    # Only ever one of FOCUSED_EVENTS: int codes instead of a column of repeated strings
+    events["event_type"] = pd.Categorical(events["event_type"], categories=FOCUSED_EVENTS)
+    return events
 
 @st.cache_data(ttl=15)
 def load_data():
-    calls = pd.read_sql("select * from calls", engine)
-    events = pd.read_sql("select * from events", engine)
-    return calls, events
+    with engine.connect() as conn:
+        return {
+            "tiles": _top_tiles(conn),
+            "outcomes": _counts(conn, "outcome"),
+            "sentiments": _counts(conn, "sentiment"),
+            "avg_sales_value": _avg_accepted_rate(conn),
+            "events_focused": _recent_focused_events(conn),
+        }
 
 st.title("Inbound Carrier Sales – Metrics (FMCSA + Negotiation)")
 
 try:
-    calls, events = load_data()
+    data = load_data()
 except Exception as e:
     st.error(f"Database not reachable/initialized. Check DATABASE_URL. Details: {e}")
     st.stop()
 
-# Focus dashboard on FMCSA + negotiation only
-FOCUSED_EVENTS = {"fmcsa.verify", "fmcsa.verification", "nego.round"}
-events_focused = events[events["event_type"].isin(FOCUSED_EVENTS)] if len(events) else events
+n_calls, acc_rate, avg_rounds = data["tiles"]
+outcomes, sentiments = data["outcomes"], data["sentiments"]
+avg_sales_value = data["avg_sales_value"]
+events_focused = data["events_focused"]
 
 # ===== Top tiles =====
 c1, c2, c3 = st.columns(3)
 with c1:
-    st.metric("Total Calls", int(len(calls)))
+    st.metric("Total Calls", n_calls)
 with c2:
-    acc_rate = (calls["outcome"].eq("accepted").mean() * 100) if len(calls) else 0.0
     st.metric("Acceptance Rate", f"{acc_rate:.1f}%")
 with c3:
-    # average negotiation rounds only across calls that had at least one nego.round
-    if len(events_focused):
-        nego_counts = (events_focused[events_focused["event_type"] == "nego.round"]
-                       .groupby("call_id").size())
-        avg_rounds = float(nego_counts.mean()) if len(nego_counts) else 0.0
-    else:
-        avg_rounds = 0.0
     st.metric("Avg Negotiation Rounds", f"{avg_rounds:.2f}")
 
 # ===== Outcomes (includes 'ineligible' from FMCSA failures) =====
 st.subheader("Outcomes (from calls table)")
-if len(calls) and calls["outcome"].notna().any():
-    st.bar_chart(calls["outcome"].fillna("unknown").value_counts())
+if len(outcomes):
+    st.bar_chart(outcomes)
 else:
     st.info("No outcomes yet. Make a call that reaches summary or logs ineligible at FMCSA.")
 
 # ===== Sentiment (if you later store it on call close) =====
 st.subheader("Sentiment (if captured)")
-if len(calls) and "sentiment" in calls.columns and calls["sentiment"].notna().any():
-    st.bar_chart(calls["sentiment"].fillna("unknown").value_counts())
+if len(sentiments):
+    st.bar_chart(sentiments)
 else:
     st.caption("No sentiment logged yet.")
 
 # ===== Agreed Rate for accepted calls =====
 st.subheader("Average Sales Value (accepted only)")
-accepted_rates = calls.loc[calls["outcome"] == "accepted", "agreed_rate"].dropna()
-if len(accepted_rates):
-    st.metric("Avg Sales Value", f"${accepted_rates.mean():,.2f}")
+if avg_sales_value is not None:
+    st.metric("Avg Sales Value", f"${avg_sales_value:,.2f}")
 else:
     st.caption("No accepted calls with agreed_rate yet.")
 
 # ===== Recent FMCSA + Negotiation Events =====
 st.subheader("Recent FMCSA + Negotiation Events")
 if len(events_focused):
-    st.dataframe(events_focused.sort_values("ts", ascending=False).head(100))
+    st.dataframe(events_focused)
 else:
     st.info("No FMCSA or negotiation events yet. Trigger a call or a negotiation round.")